@@ -1,16 +1,104 @@
-import json
+import mmap
 import os
 import threading
+import time
+import orjson
+from collections import defaultdict, deque
+from dataclasses import dataclass
 import random
-from datetime import datetime
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.star import Context, Star, register    
 from astrbot.api import logger
 import asyncio
 from astrbot.api.star import StarTools
 
-# 数据持久化相关配置
-LOCK = threading.Lock()  # 用于线程安全操作
+# 帮助文本只构造一次，错误/默认路径直接复用
+HELP_TEXT = (
+    "银行操作命令帮助：\n"
+    "/bank chaxun - 查询余额\n"
+    "/bank qiandao - 每日签到（100~500元，含小数）\n"
+    "/bank transfer 本行 <目标卡号> <金额> - 本银行转账\n"
+    "/bank transfer <目标银行> <目标账户> <金额> - 跨行转账\n"
+    "/bank record [条数] - 查询交易记录（默认10条，最多20条）"
+)
+
+# 热路径回复模板：绑定 .format 方法，一次编译格式串，也便于集中维护文案
+BALANCE_TMPL = (
+    "账户信息：\n"
+    "卡号：{card}\n"
+    "当前余额：{bal:.2f} 元\n"
+    "查询时间：{time}"
+).format
+CHECKIN_OK_TMPL = "签到成功，余额增加{amt:.2f}元，账户余额为{bal:.2f}元".format
+TRANSFER_OK_TMPL = (
+    "向本行卡号 {card} 转账成功！\n"
+    "转账金额：{amt:.2f} 元\n"
+    "当前余额：{bal:.2f} 元"
+).format
+XTRANSFER_OK_TMPL = (
+    "已成功向{bank}的账户{account}转账{amt:.2f}元。\n"
+    "当前余额：{bal:.2f} 元"
+).format
+INSUFFICIENT_TMPL = "余额不足！当前余额：{bal:.2f} 元".format
+
+# 同一秒内的时间/日期字符串复用缓存，避免每笔交易都调用 strftime
+_TS_CACHE = [0, "", ""]
+
+def _refresh_ts():
+    t = int(time.time())
+    if _TS_CACHE[0] != t:
+        lt = time.localtime(t)
+        _TS_CACHE[0] = t
+        _TS_CACHE[1] = time.strftime("%Y-%m-%d %H:%M:%S", lt)
+        _TS_CACHE[2] = time.strftime("%Y-%m-%d", lt)
+
+def _now_str() -> str:
+    """返回 '%Y-%m-%d %H:%M:%S' 格式的当前时间，秒级缓存"""
+    _refresh_ts()
+    return _TS_CACHE[1]
+
+def _today_str() -> str:
+    """返回 '%Y-%m-%d' 格式的当前日期，秒级缓存"""
+    _refresh_ts()
+    return _TS_CACHE[2]
+
+def _to_cents(value):
+    """金额统一用整数分表示；旧数据里以元为单位的浮点数迁移为分"""
+    return round(value * 100) if isinstance(value, float) else value
+
+@dataclass(slots=True)
+class TxRecord:
+    """单条交易记录：固定槽位，省去每条记录一个字典的分配开销
+
+    金额字段以整数分为单位；orjson 原生支持 dataclass 序列化，
+    快照和预写日志无需额外转换。
+    """
+    time: str
+    type: str
+    amount: int
+    target: str | None
+    balance: int
+    line: str = ""  # 预渲染的展示行，记录不可变，只格式化一次
+
+    def __post_init__(self):
+        if not self.line:
+            self.line = (
+                f"{self.time} - {self.type}：{self.amount / 100:.2f}元 "
+                f"{'→ ' + str(self.target) if self.target else ''} "
+                f"[余额：{self.balance / 100:.2f}元]"
+            )
+
+    @classmethod
+    def from_dict(cls, d):
+        """从快照/日志里的字典还原记录，兼容旧格式"""
+        return cls(
+            time=d.get('time', ''),
+            type=d.get('type', ''),
+            amount=_to_cents(d.get('amount', 0)),
+            target=d.get('target'),
+            balance=_to_cents(d.get('balance', 0)),
+            line=d.get('line', ''),
+        )
 
 class BankData:
     """银行数据管理类，负责数据的加载、保存和线程安全操作"""
@@ -18,74 +106,279 @@ class BankData:
         self.data_dir = StarTools.get_data_dir("xfbank")
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.data_file = self.data_dir / "bank_data.json"
+        self.wal_file = self.data_dir / "bank_data.wal"
         self.accounts = {}      # {user_id: 余额}
         self.cards = {}         # {user_id: 卡号}
         self.transactions = {}  # {user_id: [交易记录]}
         self.last_checkin = {}  # {user_id: 上次签到日期}
         self.card_to_user = {}  # {卡号: user_id}
+        self.rng = random.Random()  # 独立实例，绕开 random 模块级锁
+        self._dirty = False           # 有未落盘的变更时为 True
+        self.flush_event = asyncio.Event()  # 关键操作触发的立即落盘信号
+        # 账户互斥按用户细分，落盘用独立锁，磁盘 I/O 不再阻塞转账路径
+        self.account_locks = defaultdict(asyncio.Lock)  # {user_id: 锁}
+        self._snapshot_lock = asyncio.Lock()  # 串行化"拷贝+写盘"，快照按拷贝顺序落盘
+        self._wal_lock = threading.Lock()   # 保护日志追加与清空
+        self._wal_seq = 0  # 单调递增的日志序号，快照记下已并入的最大序号
         self.load_data()
+        # 追加式预写日志：每次变更只追加一行，快照时清空
+        self._wal = open(self.wal_file, 'ab', buffering=0)
 
     def load_data(self):
         """从文件加载数据"""
+        skip_seq = 0
         if self.data_file.exists():
             try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.accounts = data.get('accounts', {})
+                # mmap 后零拷贝交给 C 解析器，省去一次文件大小的中间缓冲
+                with open(self.data_file, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size == 0:
+                        data = {}
+                    else:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            data = orjson.loads(memoryview(mm))
+                    # 旧快照里的浮点余额（元）迁移为整数分
+                    self.accounts = {
+                        uid: _to_cents(balance)
+                        for uid, balance in data.get('accounts', {}).items()
+                    }
                     self.cards = data.get('cards', {})
-                    self.transactions = data.get('transactions', {})
+                    self.transactions = {
+                        uid: deque((TxRecord.from_dict(r) for r in records), maxlen=100)
+                        for uid, records in data.get('transactions', {}).items()
+                    }
                     self.last_checkin = data.get('last_checkin', {})
                     # 构建卡号反查索引
                     self.card_to_user = {v: k for k, v in self.cards.items()}
+                    # 快照已并入的日志序号，之后分配的序号接着往上走
+                    skip_seq = data.get('wal_seq', 0)
+                    self._wal_seq = skip_seq
                 logger.info("银行数据加载成功")
             except Exception as e:
                 logger.error(f"加载银行数据失败: {str(e)}")
+        self.replay_wal(skip_seq)
 
-    def save_data(self):
-        """保存数据到文件"""
+    def replay_wal(self, skip_seq=0):
+        """重放预写日志，恢复上次快照之后的变更
+
+        序号不大于 skip_seq 的条目已并入快照：余额重放是幂等的，但交易
+        记录是追加的，重放会造成重复，所以这类条目直接跳过。旧格式条目
+        没有序号，照常重放。
+        """
+        if not self.wal_file.exists():
+            return
+        count = 0
+        skipped = 0
+        damaged = False
         try:
-            with LOCK:
-                data = {
-                    'accounts': self.accounts,
-                    'cards': self.cards,
-                    'transactions': self.transactions,
-                    'last_checkin': self.last_checkin
-                }
-                with open(self.data_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+            with open(self.wal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = orjson.loads(line)
+                    seq = entry.get('seq', 0)
+                    if seq > self._wal_seq:
+                        self._wal_seq = seq
+                    if seq and seq <= skip_seq:
+                        skipped += 1
+                        continue
+                    self._apply_wal_entry(entry)
+                    count += 1
+            if count:
+                logger.info(f"预写日志重放完成，共{count}条变更")
+        except Exception as e:
+            damaged = True
+            logger.error(f"重放预写日志失败: {str(e)}")
+        finally:
+            # 置脏让下次快照把重放的变更并入（或清掉已并入/损坏的条目），
+            # 日志随之收缩；放在 finally 里，重放中途失败也能触发收缩，
+            # 否则坏日志会留在盘上，每次重启都重复这段半截重放
+            if count or skipped or damaged:
+                self._dirty = True
+
+    def _apply_wal_entry(self, entry):
+        """将单条日志变更应用到内存状态"""
+        op = entry.get('op')
+        if op == 'open':
+            uid, card = entry['user'], entry['card']
+            self.cards[uid] = card
+            self.card_to_user[card] = uid
+            self.accounts.setdefault(uid, 0)
+        elif op == 'checkin':
+            self.accounts[entry['user']] = _to_cents(entry['balance'])
+            self.last_checkin[entry['user']] = entry['date']
+        elif op == 'transfer':
+            self.accounts[entry['from']] = _to_cents(entry['from_balance'])
+            self.accounts[entry['to']] = _to_cents(entry['to_balance'])
+        elif op == 'xtransfer':
+            self.accounts[entry['user']] = _to_cents(entry['balance'])
+        for uid, record in entry.get('tx', []):
+            self._append_record(uid, TxRecord.from_dict(record))
+
+    def append_wal(self, entry, flush=False):
+        """向预写日志追加一条变更记录
+
+        flush=True 时唤醒后台保存任务立即做快照（用于转账等关键操作），
+        其余操作只置脏标记，由定时任务合并落盘。
+        """
+        try:
+            with self._wal_lock:
+                self._wal_seq += 1
+                entry['seq'] = self._wal_seq
+                self._wal.write(orjson.dumps(entry) + b"\n")
+        except Exception as e:
+            logger.error(f"写入预写日志失败: {str(e)}")
+        self._dirty = True
+        if flush:
+            self.flush_event.set()
+
+    def snapshot_state(self):
+        """在事件循环线程上拷贝当前状态，无变更时返回 None
+
+        所有变更都发生在事件循环线程且中间没有 await，在同一线程上
+        拷贝保证快照落在完整的一笔变更边界上，不会看到转出未转入的
+        中间态，也不会在遍历时碰上字典扩容。
+        """
+        if not self._dirty:
+            return None
+        # 先清标记再拷贝：写盘期间的新变更会重新置脏，下个周期补写
+        self._dirty = False
+        data = {
+            'accounts': self.accounts.copy(),
+            'cards': self.cards.copy(),
+            'transactions': {uid: list(records) for uid, records in self.transactions.items()},
+            'last_checkin': self.last_checkin.copy(),
+            # 本次快照已并入的日志序号，重启时据此跳过已覆盖的条目
+            'wal_seq': self._wal_seq
+        }
+        # 记下拷贝时刻的日志长度，之后追加的条目不在本次快照覆盖范围内
+        with self._wal_lock:
+            wal_size = os.fstat(self._wal.fileno()).st_size
+        return data, wal_size
+
+    def write_snapshot(self, data, wal_size):
+        """阻塞的快照写盘，在线程池中执行"""
+        try:
+            # 先序列化到内存，再一次性写出，避免逐段 write 系统调用
+            buf = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+            # 写入临时文件后原子替换，中途崩溃不会损坏旧快照
+            tmp_file = self.data_file.with_suffix('.json.tmp')
+            with open(tmp_file, 'wb') as f:
+                f.write(buf)
+                f.flush()
+                # 确保数据落盘后再替换，快照只在 5 分钟级别发生，fsync 开销可接受
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.data_file)
+            # 只清掉快照已覆盖的前缀；写盘期间追加的条目前移保留。
+            # 若在替换快照后、清理前崩溃，残留的已覆盖条目会在重放时
+            # 按快照里的 wal_seq 跳过，交易记录不会重复
+            with self._wal_lock:
+                with open(self.wal_file, 'r+b') as wf:
+                    wf.seek(wal_size)
+                    suffix = wf.read()
+                    wf.seek(0)
+                    wf.write(suffix)
+                    wf.truncate()
             logger.info("银行数据保存成功")
         except Exception as e:
+            self._dirty = True
             logger.error(f"保存银行数据失败: {str(e)}")
 
+    async def save_data_async(self):
+        """拷贝在事件循环上完成，磁盘写交给线程池
+
+        锁覆盖整个"拷贝+写盘"：下一次拷贝必须等上一次写完，快照严格
+        按拷贝顺序落盘，terminate 的收尾保存不会被还在途中的定时快照
+        用旧状态覆盖。
+        """
+        async with self._snapshot_lock:
+            snapshot = self.snapshot_state()
+            if snapshot is None:
+                return
+            await asyncio.to_thread(self.write_snapshot, *snapshot)
+
+    def _append_record(self, user_id, record):
+        """将一条交易记录追加到用户的记录列表
+
+        deque(maxlen=100) 在超限时 O(1) 淘汰最旧记录，无需切片复制。
+        记录会被快照副本引用，创建后不得复用或改写。
+        """
+        self.transactions.setdefault(user_id, deque(maxlen=100)).append(record)
+
+    def _new_card(self) -> str:
+        """生成唯一卡号：X+四位数字，用反查索引判重"""
+        while True:
+            number = f"X{self.rng.randint(1000, 9999)}"
+            if number not in self.card_to_user:
+                return number
+
+    def open_account(self, user_id):
+        """开户：卡号生成、双向索引、建账与日志追加集中在一处
+
+        五个字段的更新只在这里发生，保证卡号索引不会失步。
+        返回新卡号。
+        """
+        card_number = self._new_card()
+        self.cards[user_id] = card_number
+        self.card_to_user[card_number] = user_id
+        self.accounts[user_id] = 0
+        record = self.add_transaction(user_id, "开户", 0)
+        self.append_wal({
+            'op': 'open', 'user': user_id, 'card': card_number,
+            'tx': [[user_id, record]]
+        })
+        return card_number
+
+    def apply_transfer(self, src_user_id, dst_user_id, amount):
+        """本行转账：完成双方余额更新、记账与日志追加
+
+        调用方需先按固定顺序持有双方的 account_locks。
+        返回转出方的新余额，供回复消息直接使用。
+        """
+        accounts = self.accounts
+        src_balance = accounts.get(src_user_id, 0) - amount
+        dst_balance = accounts.get(dst_user_id, 0) + amount
+        accounts[src_user_id] = src_balance
+        accounts[dst_user_id] = dst_balance
+        record_out = self.add_transaction(
+            src_user_id, "转账支出", amount, self.cards[dst_user_id])
+        record_in = self.add_transaction(
+            dst_user_id, "转账收入", amount, self.cards[src_user_id])
+        self.append_wal({
+            'op': 'transfer', 'from': src_user_id, 'to': dst_user_id,
+            'from_balance': src_balance,
+            'to_balance': dst_balance,
+            'tx': [[src_user_id, record_out], [dst_user_id, record_in]]
+        }, flush=True)
+        return src_balance
+
     def add_transaction(self, user_id, transaction_type, amount, target=None):
-        """添加交易记录"""
-        if user_id not in self.transactions:
-            self.transactions[user_id] = []
-            
-        record = {
-            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'type': transaction_type,
-            'amount': amount,
-            'target': target,
-            'balance': self.accounts.get(user_id, 0)
-        }
-        
-        self.transactions[user_id].append(record)
-        # 只保留最近100条记录
-        if len(self.transactions[user_id]) > 100:
-            self.transactions[user_id] = self.transactions[user_id][-100:]
+        """添加交易记录，返回生成的记录供写入预写日志"""
+        record = TxRecord(
+            time=_now_str(),
+            type=transaction_type,
+            amount=amount,
+            target=target,
+            balance=self.accounts.get(user_id, 0),
+        )
+        self._append_record(user_id, record)
         # 不再立即保存数据
+        return record
 
 # 全局银行数据实例
 bank_data = BankData()
 
-def generate_card_number(user_id: str) -> str:
-    """生成唯一卡号：X+四位数字，不重复"""
-    existing_cards = set(bank_data.cards.values())
-    while True:
-        number = f"X{random.randint(1000, 9999)}"
-        if number not in existing_cards:
-            return number
+def _parse_args(event, command):
+    """分割消息并去掉前导命令名
+
+    maxsplit=5 足够覆盖参数最多的 transfer 命令，恶意超长输入
+    也只会产生常数个 token。
+    """
+    args = event.message_str.split(None, 5)
+    if args and args[0].lower() == command:
+        args = args[1:]
+    return args
 
 async def other_bank_transfer(bank_name: str, target_account: str, amount: float) -> bool:
     """模拟跨行转账接口"""
@@ -98,104 +391,107 @@ class BankPlugin(Star):
     def __init__(self, context: Context):
         super().__init__(context)
         self.auto_save_task = None
+        self._stop = asyncio.Event()  # 通知后台保存任务退出
 
     async def initialize(self):
         logger.info("虚拟银行插件已初始化")
         self.auto_save_task = asyncio.create_task(self.auto_save())
 
     async def terminate(self):
-        bank_data.save_data()
+        # 先唤醒后台任务让其退出，再做最终落盘
+        self._stop.set()
+        bank_data.flush_event.set()
+        await bank_data.save_data_async()
         logger.info("虚拟银行插件已卸载")
         if self.auto_save_task:
             self.auto_save_task.cancel()
 
     async def auto_save(self):
-        while True:
-            bank_data.save_data()
-            await asyncio.sleep(300)
-
-    @filter.command("xfbank")
-    async def xfbank(self, event: AstrMessageEvent):
-        # 只保留命令后的参数
-        args = event.message_str.strip().split()
-        if args and args[0].lower() == "xfbank":
-            args = args[1:]
-        logger.info(f"xfbank命令收到参数: {args}")
-        user_id = event.get_sender_id()
-        
-        # 开户命令：/xfbank kaihu
-        if len(args) >= 1 and args[0] == "kaihu":
-            if user_id in bank_data.cards:
-                yield event.plain_result(f"你已开户，卡号为：{bank_data.cards[user_id]}")
+        # 1 秒去抖：突发的 N 条命令合并成一次快照，落盘延迟上界 1 秒
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(bank_data.flush_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            bank_data.flush_event.clear()
+            if self._stop.is_set():
                 return
-                
-            # 创建账户
-            card_number = generate_card_number(user_id)
-            bank_data.cards[user_id] = card_number
-            bank_data.card_to_user[card_number] = user_id
-            bank_data.accounts[user_id] = 0
-            bank_data.add_transaction(user_id, "开户", 0)
-            bank_data.save_data()
-            
-            yield event.plain_result(
-                f"开户成功！\n卡号：{card_number}\n"
-                f"无需密码，所有操作直接使用命令即可"
-            )
+            # 磁盘写放到线程池，事件循环继续处理其他用户的命令
+            await bank_data.save_data_async()
+
+    # ---------- 子命令实现（通过下方的分发表调用） ----------
+
+    async def _cmd_help(self, event, args, user_id):
+        """命令帮助"""
+        yield event.plain_result(HELP_TEXT)
+
+    async def _cmd_kaihu(self, event, args, user_id):
+        """开户命令：/xfbank kaihu"""
+        if user_id in bank_data.cards:
+            yield event.plain_result(f"你已开户，卡号为：{bank_data.cards[user_id]}")
             return
-    
+
+        # 创建账户
+        card_number = bank_data.open_account(user_id)
+
         yield event.plain_result(
-       "银行操作命令帮助：\n"
-       "银行操作命令帮助：\n"
-       "/bank chaxun - 查询余额\n"
-       "/bank qiandao - 每日签到（100~500元，含小数）\n"
-       "/bank transfer 本行 <目标卡号> <金额> - 本银行转账\n"
-       "/bank transfer <目标银行> <目标账户> <金额> - 跨行转账\n"
-       "/bank record [条数] - 查询交易记录（默认10条，最多20条）"
+            f"开户成功！\n卡号：{card_number}\n"
+            f"无需密码，所有操作直接使用命令即可"
         )
 
-    @filter.command("bank")
-    async def bank(self, event: AstrMessageEvent):
-        user_id = event.get_sender_id()
-        args = event.message_str.strip().split()
-        if args and args[0].lower() == "bank":
-            args = args[1:]
-
-        # 1. 查询余额：/bank chaxun
-        if len(args) == 1 and args[0] == "chaxun":
-            balance = bank_data.accounts.get(user_id, 0)
-            yield event.plain_result(
-                f"账户信息：\n"
-                f"卡号：{bank_data.cards.get(user_id, '未开户')}\n"
-                f"当前余额：{balance:.2f} 元\n"
-                f"查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-            )
+    async def _cmd_chaxun(self, event, args, user_id):
+        """查询余额：/bank chaxun"""
+        if len(args) != 1:
+            async for r in self._cmd_help(event, args, user_id):
+                yield r
             return
+        balance = bank_data.accounts.get(user_id, 0)
+        yield event.plain_result(BALANCE_TMPL(
+            card=bank_data.cards.get(user_id, '未开户'),
+            bal=balance / 100,
+            time=_now_str(),
+        ))
 
-        # 2. 签到：/bank qiandao
-        elif len(args) == 1 and args[0] == "qiandao":
-            if user_id not in bank_data.cards:
-                yield event.plain_result("请先开户，发送 /xfbank kaihu")
-                return
-            today = datetime.now().strftime("%Y-%m-%d")
-            last = bank_data.last_checkin.get(user_id, "")
-            if last == today:
-                yield event.plain_result("今天已签到，请勿重复签到。")
-                return
-            amount = round(random.uniform(100, 500), 2)
-            bank_data.accounts[user_id] = round(bank_data.accounts.get(user_id, 0) + amount, 2)
-            bank_data.last_checkin[user_id] = today
-            bank_data.add_transaction(user_id, "每日签到", amount)
-            bank_data.save_data()
-            yield event.plain_result(
-                f"签到成功，余额增加{amount:.2f}元，账户余额为{bank_data.accounts[user_id]:.2f}元"
-            )
+    async def _cmd_qiandao(self, event, args, user_id):
+        """签到：/bank qiandao"""
+        if len(args) != 1:
+            async for r in self._cmd_help(event, args, user_id):
+                yield r
+            return
+        if user_id not in bank_data.cards:
+            yield event.plain_result("请先开户，发送 /xfbank kaihu")
+            return
+        today = _today_str()
+        last = bank_data.last_checkin.get(user_id, "")
+        if last == today:
+            yield event.plain_result("今天已签到，请勿重复签到。")
             return
+        accounts = bank_data.accounts
+        # 10000~50000 分即 100~500 元，含小数
+        amount = bank_data.rng.randrange(10000, 50001)
+        new_balance = accounts.get(user_id, 0) + amount
+        accounts[user_id] = new_balance
+        bank_data.last_checkin[user_id] = today
+        record = bank_data.add_transaction(user_id, "每日签到", amount)
+        bank_data.append_wal({
+            'op': 'checkin', 'user': user_id, 'date': today,
+            'balance': new_balance,
+            'tx': [[user_id, record]]
+        })
+        yield event.plain_result(CHECKIN_OK_TMPL(amt=amount / 100, bal=new_balance / 100))
 
-        # 3. 本银行转账：/bank transfer 本行 <目标卡号> <金额>
-        elif len(args) == 4 and args[0] == "transfer" and args[1] == "本行":
+    async def _cmd_transfer(self, event, args, user_id):
+        """转账：/bank transfer 本行|<目标银行> ..."""
+        if len(args) != 4:
+            async for r in self._cmd_help(event, args, user_id):
+                yield r
+            return
+
+        # 本银行转账：/bank transfer 本行 <目标卡号> <金额>
+        if args[1] == "本行":
             target_card = args[2]
             try:
-                amount = round(float(args[3]), 2)
+                amount = round(float(args[3]) * 100)  # 元转整数分
                 if amount <= 0:
                     yield event.plain_result("转账金额必须为正数")
                     return
@@ -206,89 +502,117 @@ class BankPlugin(Star):
                 if target_user_id == user_id:
                     yield event.plain_result("不能向自己转账")
                     return
-                current_balance = bank_data.accounts.get(user_id, 0)
-                if current_balance < amount:
-                    yield event.plain_result(f"余额不足！当前余额：{current_balance:.2f} 元")
-                    return
-                with LOCK:
-                    bank_data.accounts[user_id] = round(current_balance - amount, 2)
-                    bank_data.accounts[target_user_id] = round(bank_data.accounts.get(target_user_id, 0) + amount, 2)
-                bank_data.add_transaction(user_id, "转账支出", amount, target_card)
-                bank_data.add_transaction(target_user_id, "转账收入", amount, bank_data.cards[user_id])
-                bank_data.save_data()
-                yield event.plain_result(
-                    f"向本行卡号 {target_card} 转账成功！\n"
-                    f"转账金额：{amount:.2f} 元\n"
-                    f"当前余额：{bank_data.accounts[user_id]:.2f} 元"
-                )
+                # 按固定顺序取双方账户锁，避免两笔反向转账互相死锁
+                first, second = sorted((user_id, target_user_id))
+                locks = bank_data.account_locks
+                async with locks[first], locks[second]:
+                    current_balance = bank_data.accounts.get(user_id, 0)
+                    if current_balance < amount:
+                        yield event.plain_result(INSUFFICIENT_TMPL(bal=current_balance / 100))
+                        return
+                    new_balance = bank_data.apply_transfer(user_id, target_user_id, amount)
+                yield event.plain_result(TRANSFER_OK_TMPL(
+                    card=target_card, amt=amount / 100, bal=new_balance / 100))
                 return
             except ValueError:
                 yield event.plain_result("请输入正确的金额数字")
                 return
 
-        # 4. 跨行转账：/bank transfer <目标银行> <目标账户> <金额>
-        elif len(args) == 4 and args[0] == "transfer":
+        # 跨行转账：/bank transfer <目标银行> <目标账户> <金额>
+        else:
             bank_name = args[1]
             target_account = args[2]
             try:
-                amount = round(float(args[3]), 2)
+                amount = round(float(args[3]) * 100)  # 元转整数分
                 if amount <= 0:
                     yield event.plain_result("转账金额必须为正数")
                     return
-                current_balance = bank_data.accounts.get(user_id, 0)
-                if current_balance < amount:
-                    yield event.plain_result(f"余额不足！当前余额：{current_balance:.2f} 元")
-                    return
-                bank_data.accounts[user_id] = round(current_balance - amount, 2)
-                success = await other_bank_transfer(bank_name, target_account, amount)
-                if success:
-                    bank_data.add_transaction(
+                # 持有转出方账户锁跨越远程调用，期间不能再发起转账；
+                # 成功前不动余额，失败路径没有需要回滚（和落盘）的状态
+                async with bank_data.account_locks[user_id]:
+                    accounts = bank_data.accounts
+                    current_balance = accounts.get(user_id, 0)
+                    if current_balance < amount:
+                        yield event.plain_result(INSUFFICIENT_TMPL(bal=current_balance / 100))
+                        return
+                    success = await other_bank_transfer(bank_name, target_account, amount / 100)
+                    if not success:
+                        yield event.plain_result("跨行转账失败，请稍后再试")
+                        return
+                    # 远程调用期间签到可能已入账，扣款前重读余额
+                    new_balance = accounts.get(user_id, 0) - amount
+                    accounts[user_id] = new_balance
+                    record = bank_data.add_transaction(
                         user_id, f"跨行转账至{bank_name}", amount, target_account
                     )
-                    bank_data.save_data()
-                    yield event.plain_result(
-                        f"已成功向{bank_name}的账户{target_account}转账{amount:.2f}元。\n"
-                        f"当前余额：{bank_data.accounts[user_id]:.2f} 元"
-                    )
-                else:
-                    bank_data.accounts[user_id] = current_balance
-                    yield event.plain_result("跨行转账失败，请稍后再试")
+                    bank_data.append_wal({
+                        'op': 'xtransfer', 'user': user_id,
+                        'balance': new_balance,
+                        'tx': [[user_id, record]]
+                    }, flush=True)
+                yield event.plain_result(XTRANSFER_OK_TMPL(
+                    bank=bank_name, account=target_account,
+                    amt=amount / 100, bal=new_balance / 100))
                 return
             except ValueError:
                 yield event.plain_result("请输入正确的金额数字")
                 return
 
-        # 5. 查询交易记录：/bank record [条数]
-        elif (len(args) == 1 or len(args) == 2) and args[0] == "record":
-            try:
-                if len(args) == 2:
-                    count = min(int(args[1]), 20)
-                else:
-                    count = 10
-                records = bank_data.transactions.get(user_id, [])
-                if not records:
-                    yield event.plain_result("暂无交易记录")
-                    return
-                display_records = records[-count:][::-1]
-                result = ["最近交易记录："]
-                for idx, record in enumerate(display_records, 1):
-                    result.append(
-                        f"{idx}. {record['time']} - {record['type']}：{float(record['amount']):.2f}元 "
-                        f"{'→ ' + str(record['target']) if record['target'] else ''} "
-                        f"[余额：{float(record['balance']):.2f}元]"
-                    )
-                yield event.plain_result("\n".join(result))
-                return
-            except ValueError:
-                yield event.plain_result("用法：/bank record [条数]")
+    async def _cmd_record(self, event, args, user_id):
+        """查询交易记录：/bank record [条数]"""
+        if len(args) > 2:
+            async for r in self._cmd_help(event, args, user_id):
+                yield r
+            return
+        try:
+            if len(args) == 2:
+                count = min(int(args[1]), 20)
+            else:
+                count = 10
+            records = bank_data.transactions.get(user_id, [])
+            if not records:
+                yield event.plain_result("暂无交易记录")
                 return
+            display_records = list(records)[-count:][::-1]
+            body = "\n".join(
+                f"{idx}. {record.line}"
+                for idx, record in enumerate(display_records, 1)
+            )
+            yield event.plain_result("最近交易记录：\n" + body)
+        except ValueError:
+            yield event.plain_result("用法：/bank record [条数]")
 
-        # 命令帮助
-        yield event.plain_result(
-            "银行操作命令帮助：\n"
-            "/bank chaxun - 查询余额\n"
-            "/bank qiandao - 每日签到（100~500元，含小数）\n"
-            "/bank transfer 本行 <目标卡号> <金额> - 本银行转账\n"
-            "/bank transfer <目标银行> <目标账户> <金额> - 跨行转账\n"
-            "/bank record [条数] - 查询交易记录（默认10条，最多20条）"
-        )
+    # ---------- 子命令分发表：O(1) 哈希查找代替逐个字符串比较 ----------
+    _XFBANK_CMDS = {
+        "kaihu": _cmd_kaihu,
+    }
+    _BANK_CMDS = {
+        "chaxun": _cmd_chaxun,
+        "qiandao": _cmd_qiandao,
+        "transfer": _cmd_transfer,
+        "record": _cmd_record,
+    }
+
+    @filter.command("xfbank")
+    async def xfbank(self, event: AstrMessageEvent):
+        # 只保留命令后的参数
+        args = _parse_args(event, "xfbank")
+        logger.info(f"xfbank命令收到参数: {args}")
+        user_id = event.get_sender_id()
+
+        handler = self._XFBANK_CMDS.get(args[0]) if args else None
+        if handler is None:
+            handler = BankPlugin._cmd_help
+        async for r in handler(self, event, args, user_id):
+            yield r
+
+    @filter.command("bank")
+    async def bank(self, event: AstrMessageEvent):
+        user_id = event.get_sender_id()
+        args = _parse_args(event, "bank")
+
+        handler = self._BANK_CMDS.get(args[0]) if args else None
+        if handler is None:
+            handler = BankPlugin._cmd_help
+        async for r in handler(self, event, args, user_id):
+            yield r